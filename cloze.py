@@ -36,7 +36,7 @@ class Cloze:
         self.parent_note_filepath = parent_note_filepath
 
         self.original_note_path = tag["data-path"]
-        self.parent_note_folder = os.path.join(self.fs.math_folder(), self.fs.get_path_hash(parent_note_filepath))
+        self.parent_note_folder = self.fs.get_note_folder(parent_note_filepath)
         self.original_note_folder = os.path.join(self.parent_note_folder, self.fs.get_path_hash(self.original_note_path))
 
         self.cloze_folder = self.find_or_create_folder(self.get_folder_num(tag))
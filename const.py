@@ -10,3 +10,12 @@ BLOCK_REF_HASH_REGEX = r"(.+)( \^[=a-zA-Z0-9]+)"
 INCLUDED_BLOCKS_FOLDER = "blocks"
 IMAGES_FOLDER = "images"
 DELETED_DATA_FN = "deleted.json"
+NOTES_FOLDER = "notes"
+SHARD_DEPTH = 2
+SHARD_WIDTH = 2
+LEGACY_NOTE_FOLDER_REGEX = r"^[0-9a-f]{15}$"
+LAYOUT_DATA_FN = "layout.json"
+LAYOUT_VERSION = 2
+TMP_FILE_PREFIX = ".tmp-"
+IMAGE_STORE_DATA_FN = "image_store.json"
+IMAGE_REFS_FN = "image_refs.json"
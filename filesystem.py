@@ -1,6 +1,7 @@
 import hashlib
 import os
-from const import MATH_FOLDER_REL, HISTORY_DATA_FN, INCLUDED_BLOCKS_FOLDER, IMAGES_FOLDER, DELETED_DATA_FN
+from const import MATH_FOLDER_REL, HISTORY_DATA_FN, INCLUDED_BLOCKS_FOLDER, IMAGES_FOLDER, DELETED_DATA_FN, \
+    NOTES_FOLDER, SHARD_DEPTH, SHARD_WIDTH, LAYOUT_DATA_FN, IMAGE_STORE_DATA_FN, IMAGE_REFS_FN
 
 
 class FileSystem:
@@ -18,11 +19,29 @@ class FileSystem:
     def math_folder(self):
         return os.path.join(self.sm_collection_root, MATH_FOLDER_REL)
 
+    def notes_folder(self):
+        return os.path.join(self.math_folder(), NOTES_FOLDER)
+
+    def image_store_folder(self):
+        return os.path.join(self.math_folder(), IMAGES_FOLDER)
+
     def get_history_file(self):
         return os.path.join(self.math_folder(), HISTORY_DATA_FN)
 
+    def get_layout_file(self):
+        return os.path.join(self.math_folder(), LAYOUT_DATA_FN)
+
+    def get_image_store_file(self):
+        return os.path.join(self.math_folder(), IMAGE_STORE_DATA_FN)
+
     def get_note_folder(self, note_file_path: str):
-        return os.path.join(self.math_folder(), self.get_path_hash(note_file_path))
+        return self.get_sharded_note_folder(self.get_path_hash(note_file_path))
+
+    def get_sharded_note_folder(self, note_hash: str):
+        return os.path.join(self.notes_folder(), *self.get_shards(note_hash), note_hash)
+
+    def get_image_path(self, image_hash: str):
+        return os.path.join(self.image_store_folder(), *self.get_shards(image_hash), image_hash + ".jpg")
 
     def get_deleted_file(self):
         return os.path.join(self.math_folder(), DELETED_DATA_FN)
@@ -31,10 +50,25 @@ class FileSystem:
     def get_images_folder(note_folder: str):
         return os.path.join(note_folder, IMAGES_FOLDER)
 
+    @staticmethod
+    def get_image_refs_file(note_folder: str):
+        return os.path.join(note_folder, IMAGE_REFS_FN)
+
     @staticmethod
     def get_included_blocks_folder(note_folder: str):
         return os.path.join(note_folder, INCLUDED_BLOCKS_FOLDER)
 
+    @staticmethod
+    def get_shards(key: str):
+        """
+        Split the leading characters of a hash into nested bucket folder names, e.g. "abcdef..." -> ["ab", "cd"].
+        """
+        return [key[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_DEPTH)]
+
     @staticmethod
     def get_path_hash(file: str):
-        return hashlib.sha1(file.encode()).hexdigest()[:15]
\ No newline at end of file
+        return hashlib.sha1(file.encode()).hexdigest()[:15]
+
+    @staticmethod
+    def get_content_hash(data: bytes):
+        return hashlib.sha1(data).hexdigest()
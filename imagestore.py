@@ -0,0 +1,121 @@
+import json
+import os
+import typing as T
+from collections import defaultdict
+
+from filesystem import FileSystem
+from utils import write_atomic
+from const import IMAGE_REFS_FN
+
+
+class ImageStore:
+    """
+    Reference counts for the shared image store. Each note folder lists the images it uses and the
+    store keeps a count per image, so unused images can be removed without walking every note.
+    If a run is interrupted the counts are rebuilt from the per-note lists on the next run.
+    """
+
+    fs: FileSystem
+    data: T.Dict
+    force_render: bool
+    rendered: T.Set[str]
+
+    def __init__(self, fs: FileSystem, force_render: bool = False):
+        self.fs = fs
+        self.force_render = force_render
+        self.rendered = set()
+        self.data = self.read()
+        if not self.data.get("clean"):
+            self.rebuild()
+
+        # Only close() marks the counts clean again, so a crash part way through a run triggers a rebuild.
+        self.data["clean"] = False
+        self.write()
+
+    def read(self):
+        try:
+            with open(self.fs.get_image_store_file()) as f:
+                return json.loads(f.read())
+        except Exception:
+            pass
+
+        return {}
+
+    def write(self):
+        try:
+            write_atomic(self.fs.get_image_store_file(), json.dumps(self.data))
+        except Exception as e:
+            print(f"Failed to write image store data with exception {e}")
+
+    @property
+    def counts(self) -> T.Dict[str, int]:
+        return self.data.setdefault("counts", {})
+
+    def has(self, image_hash: str):
+        # When forcing, each image is rendered again once per run, then shared between notes as usual.
+        if self.force_render and image_hash not in self.rendered:
+            return False
+        return image_hash in self.counts and os.path.exists(self.fs.get_image_path(image_hash))
+
+    def add(self, image_hash: str):
+        self.rendered.add(image_hash)
+        self.counts.setdefault(image_hash, 0)
+
+    def update_note(self, note_folder: str, image_hashes: T.Iterable[str]):
+        old = set(self.read_note_images(self.fs, note_folder))
+        new = set(image_hashes)
+        for image_hash in new - old:
+            self.counts[image_hash] = self.counts.get(image_hash, 0) + 1
+        for image_hash in old - new:
+            self.counts[image_hash] = self.counts.get(image_hash, 1) - 1
+
+        if new or old:
+            self.write_note_images(self.fs, note_folder, new)
+
+    def collect_garbage(self):
+        for image_hash, count in list(self.counts.items()):
+            if count > 0:
+                continue
+
+            path = self.fs.get_image_path(image_hash)
+            if os.path.exists(path):
+                os.remove(path)
+            del self.counts[image_hash]
+
+    def close(self):
+        self.collect_garbage()
+        self.data["clean"] = True
+        self.write()
+
+    def rebuild(self):
+        """
+        Recount references from every note's image list and remove store files nothing refers to,
+        including temporary files left behind by interrupted renders.
+        """
+        counts = defaultdict(int)
+        for folder, _, files in os.walk(self.fs.notes_folder()):
+            if IMAGE_REFS_FN in files:
+                for image_hash in self.read_note_images(self.fs, folder):
+                    counts[image_hash] += 1
+
+        for folder, _, files in os.walk(self.fs.image_store_folder()):
+            for file in files:
+                image_hash, ext = os.path.splitext(file)
+                if ext != ".jpg" or image_hash not in counts:
+                    os.remove(os.path.join(folder, file))
+
+        self.data["counts"] = dict(counts)
+
+    @staticmethod
+    def read_note_images(fs: FileSystem, note_folder: str) -> T.List[str]:
+        try:
+            with open(fs.get_image_refs_file(note_folder)) as f:
+                return json.loads(f.read())
+        except Exception:
+            return []
+
+    @staticmethod
+    def write_note_images(fs: FileSystem, note_folder: str, image_hashes: T.Iterable[str]):
+        if not os.path.exists(note_folder):
+            os.makedirs(note_folder)
+        write_atomic(fs.get_image_refs_file(note_folder), json.dumps(sorted(image_hashes)))
@@ -0,0 +1,212 @@
+import json
+import os
+import re
+import shutil
+import typing as T
+import uuid
+
+from filesystem import FileSystem
+from imagestore import ImageStore
+from utils import write_atomic
+from const import QUESTION_HTML_FN, ANSWER_HTML_FN, CLOZE_DATA_FN, IMAGE_REFS_FN, LAYOUT_VERSION, LEGACY_NOTE_FOLDER_REGEX, TMP_FILE_PREFIX
+
+
+class LayoutMigration:
+    """
+    Moves note folders from the flat math/<hash> layout into math/notes/<ab>/<cd>/<hash>
+    and per-note images into the shared image store, rewriting the paths stored in cloze metadata.
+    Each note folder is migrated on its own, so an interrupted migration resumes on the next run.
+    """
+
+    fs: FileSystem
+    data: T.Dict
+
+    def __init__(self, fs: FileSystem):
+        self.fs = fs
+        self.data = self.read()
+
+    def read(self):
+        try:
+            with open(self.fs.get_layout_file()) as f:
+                return json.loads(f.read())
+        except Exception:
+            pass
+
+        return {}
+
+    def write(self):
+        try:
+            write_atomic(self.fs.get_layout_file(), json.dumps(self.data))
+        except Exception as e:
+            print(f"Failed to write layout data with exception {e}")
+
+    def get_legacy_note_folders(self) -> T.List[str]:
+        with os.scandir(self.fs.math_folder()) as entries:
+            return [
+                entry.path
+                for entry in entries if entry.is_dir() and re.search(LEGACY_NOTE_FOLDER_REGEX, entry.name)
+            ]
+
+    def migrate(self) -> bool:
+        """
+        Returns True once every note folder is in the sharded layout.
+        """
+        if self.data.get("version", 1) >= LAYOUT_VERSION:
+            return True
+
+        failed = False
+        for legacy_folder in self.get_legacy_note_folders():
+            try:
+                self.migrate_note_folder(legacy_folder)
+            except Exception as e:
+                print(f"Failed to migrate note folder: {legacy_folder} with exception {e}")
+                failed = True
+
+        if failed:
+            print("Some note folders were not migrated. Migration will be retried on the next run.")
+            return False
+
+        self.data["version"] = LAYOUT_VERSION
+        self.write()
+        print("Migrated math folder to the sharded layout.")
+        return True
+
+    def migrate_note_folder(self, legacy_folder: str):
+        # Images are copied into the store before any html is pointed at them, and the legacy copies
+        # are only deleted once every path has been rewritten. An interrupted run therefore leaves each
+        # reference pointing at either the legacy image or its copy in the store, and the next run
+        # finishes the job.
+        note_folder = self.fs.get_sharded_note_folder(os.path.basename(legacy_folder))
+        image_paths = self.get_image_paths(legacy_folder)
+        self.copy_images(image_paths)
+
+        for folder, _, files in os.walk(legacy_folder):
+            if CLOZE_DATA_FN in files:
+                self.rewrite_cloze(os.path.join(folder, CLOZE_DATA_FN), legacy_folder, note_folder, image_paths)
+
+        self.add_image_refs(legacy_folder, image_paths)
+        self.remove_legacy_images(legacy_folder, image_paths)
+        self.move_folder(legacy_folder, note_folder)
+
+    def get_image_paths(self, legacy_folder: str) -> T.Dict[str, str]:
+        """
+        Map each of the note's images to its path in the shared store, keyed by the hash of its contents.
+        Legacy images can't be keyed by their snippet source like new renders, so they stay referenced
+        by the note only until its next regeneration, after which the store removes them.
+        """
+        image_paths = {}
+        image_folder = self.fs.get_images_folder(legacy_folder)
+        if not os.path.exists(image_folder):
+            return image_paths
+
+        for name in os.listdir(image_folder):
+            if not name.endswith(".jpg"):
+                continue
+
+            path = os.path.join(image_folder, name)
+            with open(path, "rb") as f:
+                image_paths[path] = self.fs.get_image_path(self.fs.get_content_hash(f.read()))
+
+        return image_paths
+
+    @staticmethod
+    def copy_images(image_paths: T.Dict[str, str]):
+        for old_path, new_path in image_paths.items():
+            if os.path.exists(new_path):
+                continue
+
+            image_folder = os.path.dirname(new_path)
+            os.makedirs(image_folder, exist_ok=True)
+            tmp_path = os.path.join(image_folder, TMP_FILE_PREFIX + uuid.uuid4().hex + ".jpg")
+            try:
+                shutil.copyfile(old_path, tmp_path)
+                os.replace(tmp_path, new_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def add_image_refs(self, legacy_folder: str, image_paths: T.Dict[str, str]):
+        # Merged with any existing list, since a resumed run only sees the images that are still left.
+        image_hashes = set(ImageStore.read_note_images(self.fs, legacy_folder))
+        image_hashes.update(os.path.splitext(os.path.basename(path))[0] for path in image_paths.values())
+        if image_hashes:
+            ImageStore.write_note_images(self.fs, legacy_folder, image_hashes)
+
+    def remove_legacy_images(self, legacy_folder: str, image_paths: T.Dict[str, str]):
+        for old_path in image_paths:
+            os.remove(old_path)
+
+        image_folder = self.fs.get_images_folder(legacy_folder)
+        if os.path.exists(image_folder) and not os.listdir(image_folder):
+            os.rmdir(image_folder)
+
+    def move_folder(self, src: str, dst: str):
+        if not os.path.exists(dst):
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.replace(src, dst)
+            return
+
+        # The destination already exists, merge the legacy files into it. Legacy cloze metadata wins
+        # over anything generated since, because it holds the imported flag and the SM component paths.
+        for folder, _, files in os.walk(src):
+            dst_folder = os.path.join(dst, os.path.relpath(folder, src))
+            os.makedirs(dst_folder, exist_ok=True)
+            for file in files:
+                dst_file = os.path.join(dst_folder, file)
+                if file == IMAGE_REFS_FN and os.path.exists(dst_file):
+                    image_hashes = set(ImageStore.read_note_images(self.fs, folder))
+                    image_hashes.update(ImageStore.read_note_images(self.fs, dst_folder))
+                    ImageStore.write_note_images(self.fs, dst_folder, image_hashes)
+                elif not os.path.exists(dst_file) or \
+                        (file == CLOZE_DATA_FN and self.read_metadata(os.path.join(folder, file)) is not None):
+                    os.replace(os.path.join(folder, file), dst_file)
+        shutil.rmtree(src)
+
+    def rewrite_cloze(self, data_file: str, legacy_folder: str, note_folder: str, image_paths: T.Dict[str, str]):
+        meta = self.read_metadata(data_file)
+        if meta is None:
+            # Cloze.read_metadata treats unreadable metadata as missing, so the cloze is regenerated from
+            # scratch and there are no stored paths worth keeping. Only fix the html beside it.
+            print(f"Skipping unreadable cloze metadata: {data_file}")
+            for name in [QUESTION_HTML_FN, ANSWER_HTML_FN]:
+                path = os.path.join(os.path.dirname(data_file), name)
+                if os.path.exists(path):
+                    self.rewrite_image_paths(path, image_paths)
+            return
+
+        for key in ["folder", "question_path", "answer_path"]:
+            path = meta.get(key)
+            if path and path.startswith(legacy_folder):
+                meta[key] = note_folder + path[len(legacy_folder):]
+
+        write_atomic(data_file, json.dumps(meta))
+
+        # Imported components live in the SM collection but still reference images by path.
+        for key in ["question_path", "answer_path"]:
+            path = meta.get(key)
+            if path and path.startswith(note_folder):
+                path = legacy_folder + path[len(note_folder):]
+            if path and os.path.exists(path):
+                self.rewrite_image_paths(path, image_paths)
+
+    @staticmethod
+    def read_metadata(data_file: str) -> T.Optional[T.Dict]:
+        try:
+            with open(data_file) as f:
+                meta = json.loads(f.read())
+        except ValueError:
+            return None
+
+        return meta if isinstance(meta, dict) else None
+
+    @staticmethod
+    def rewrite_image_paths(html_file: str, image_paths: T.Dict[str, str]):
+        with open(html_file) as f:
+            html = f.read()
+
+        updated = html
+        for old_path, new_path in image_paths.items():
+            updated = updated.replace(old_path, new_path)
+
+        if updated != html:
+            write_atomic(html_file, updated)
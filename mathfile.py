@@ -9,23 +9,22 @@ import re
 from collections import defaultdict
 
 from filesystem import FileSystem
+from imagestore import ImageStore
 from mathsnippet import MathSnippet
 from bs4 import BeautifulSoup
 import datetime as dt
-from const import MATHJAX_REGEX, CLOZE_TAG_REGEX, BLOCK_REF_HASH_REGEX, BLOCK_REF_REGEX, IMAGES_FOLDER
+from const import MATHJAX_REGEX, CLOZE_TAG_REGEX, BLOCK_REF_HASH_REGEX, BLOCK_REF_REGEX
 
 
 class MathFile:
 
     fs: FileSystem
     path: Path
-    filepath_hash: str
     mdProcessor = markdown.Markdown(extensions=[mdx_mathjax.MathJaxExtension()])
 
     def __init__(self, fs: FileSystem, path: Path):
         self.fs = fs
         self.path = path
-        self.filepath_hash = self.fs.get_path_hash(str(path))
 
     @staticmethod
     def find_mathjax_snippet(html: str):
@@ -35,19 +34,17 @@ class MathFile:
     def replace(orig: str, start: int, end: int, replacement: str):
         return orig[0:start] + replacement + orig[end:]
 
-    def convert_math_to_images(self, html: str):
+    def convert_math_to_images(self, html: str, store: ImageStore):
+        image_hashes = set()
         snippet = self.find_mathjax_snippet(html)
         while snippet is not None:
-            image_folder = os.path.join(self.fs.math_folder(), self.filepath_hash, IMAGES_FOLDER)
-            if not os.path.exists(image_folder):
-                os.makedirs(image_folder)
-
-            s = MathSnippet(image_folder, snippet)
-            s.generate_image()
+            s = MathSnippet(self.fs, snippet)
+            if s.generate_image(store):
+                image_hashes.add(s.image_hash)
             html = self.replace(html, s.match.start(), s.match.end(), s.img_tag())
             snippet = self.find_mathjax_snippet(html)
 
-        return html
+        return html, image_hashes
 
     @staticmethod
     def create_cloze_span(soup):
@@ -112,16 +109,6 @@ class MathFile:
 
         return str(soup)
 
-    def clear_old_images(self):
-        image_folder = os.path.join(self.fs.math_folder(), self.filepath_hash, IMAGES_FOLDER)
-        if not os.path.exists(image_folder):
-            return
-
-        files = os.listdir(image_folder)
-        for item in files:
-            if item.endswith(".jpg"):
-                os.remove(os.path.join(image_folder, item))
-
     @staticmethod
     def has_clozes(md: str):
         soup = BeautifulSoup(md, features="html.parser")
@@ -156,7 +143,7 @@ class MathFile:
                     print(f"Removing unused cloze folder: {full_path}")
                     os.remove(full_path)
 
-    def regenerate_cards(self):
+    def regenerate_cards(self, store: ImageStore):
         start = dt.datetime.now()
         original_md = self.read()
 
@@ -166,15 +153,16 @@ class MathFile:
 
         if not self.has_clozes(converted_md):
             print(f"{self.path} does not contain any clozes. Returning early.")
+            store.update_note(self.fs.get_note_folder(str(self.path)), [])
             return
 
         self.clear_unused_cloze_folders(converted_md)
 
         html = self.mdProcessor.convert(converted_md)
-        self.clear_old_images()
-        html = self.convert_math_to_images(html)
+        html, image_hashes = self.convert_math_to_images(html, store)
 
         clozes = self.create_cloze_cards(html)
+        store.update_note(self.fs.get_note_folder(str(self.path)), image_hashes)
 
         updated_md = self.update_original_md([c for c in clozes if c.tag["data-path"] == str(self.path)], original_md)
         self.write(updated_md)
@@ -1,3 +1,5 @@
+import hashlib
+import json
 import os
 import re
 import uuid
@@ -5,16 +7,50 @@ import uuid
 import imgkit
 from PIL import Image, ImageChops
 
+from filesystem import FileSystem
+from imagestore import ImageStore
+from const import TMP_FILE_PREFIX
+
+
+HTML_TEMPLATE = """
+        <html>
+          <head>
+          <script type="text/javascript" src="https://cdnjs.cloudflare.com/ajax/libs/mathjax/2.7.5/MathJax.js?config=TeX-AMS_HTML"></script>
+          <script type="text/javascript">
+            MathJax.Hub.Config({{
+                "tex2jax": {{ inlineMath: [ [ '$', '$' ] ] }},
+                "processEscapes": "true",
+                "messageStyle": "none",
+            }});
+          </script>
+          </head>
+          <body>
+          {snippet}
+          </body>
+        </html>
+        """
+RENDER_OPTIONS = {
+    'quality': 100,
+    'zoom': 2,
+    'log-level': "none",
+    'javascript-delay': 500,
+}
+# Part of every image hash, so changing the template or the render options re-renders existing images.
+RENDER_VERSION = hashlib.sha1((HTML_TEMPLATE + json.dumps(RENDER_OPTIONS, sort_keys=True)).encode()).hexdigest()
+
 
 class MathSnippet:
 
     match: re.Match
+    image_hash: str
     image_path: str
-    note_folder: str
+    fs: FileSystem
 
-    def __init__(self, note_folder: str, match: re.Match):
+    def __init__(self, fs: FileSystem, match: re.Match):
         self.match = match
-        self.note_folder = note_folder
+        self.fs = fs
+        self.image_hash = self.fs.get_content_hash((RENDER_VERSION + self.match.group(0)).encode())
+        self.image_path = self.fs.get_image_path(self.image_hash)
 
     def img_tag(self):
         return f"<img src='file:///{self.image_path}'>"
@@ -30,33 +66,39 @@ class MathSnippet:
         if bbox:
             return im.crop(bbox)
 
-    def generate_image(self):
-        html = f"""
-        <html>
-          <head>
-          <script type="text/javascript" src="https://cdnjs.cloudflare.com/ajax/libs/mathjax/2.7.5/MathJax.js?config=TeX-AMS_HTML"></script>
-          <script type="text/javascript">
-            MathJax.Hub.Config({{
-                "tex2jax": {{ inlineMath: [ [ '$', '$' ] ] }},
-                "processEscapes": "true",
-                "messageStyle": "none",
-            }});
-          </script>
-          </head>
-          <body>
-          {self.match.group(0)}
-          </body>
-        </html>
-        """
-        options = {
-            'quality': 100,
-            'zoom': 2,
-            'log-level': "none",
-            'javascript-delay': 500,
-        }
-        name = uuid.uuid4().hex + ".jpg"
-        self.image_path = os.path.join(self.note_folder, name)
-        imgkit.from_string(html, self.image_path, options=options)
-        bg = Image.open(self.image_path)  # The image to be cropped
-        new_im = self.trim(bg)
-        new_im.save(self.image_path)
+    def generate_image(self, store: ImageStore):
+        # Images are keyed by the render version and snippet source, so identical math is only rendered once.
+        if store.has(self.image_hash):
+            return True
+        if self.image_hash in store.rendered:
+            # Already attempted this run and failed with no previous image to fall back on.
+            return False
+
+        # Recorded before rendering, so a failure isn't retried for every note that shares the snippet.
+        # After a failed forced re-render, has() then falls back to the previous image if there is one.
+        store.rendered.add(self.image_hash)
+
+        html = HTML_TEMPLATE.format(snippet=self.match.group(0))
+        image_folder = os.path.dirname(self.image_path)
+        if not os.path.exists(image_folder):
+            os.makedirs(image_folder)
+
+        # Render to a temporary file first so a half-written image is never picked up as cached.
+        tmp_path = os.path.join(image_folder, TMP_FILE_PREFIX + uuid.uuid4().hex + ".jpg")
+        try:
+            imgkit.from_string(html, tmp_path, options=RENDER_OPTIONS)
+            with Image.open(tmp_path) as bg:  # The image to be cropped
+                new_im = self.trim(bg)
+            if new_im is None:
+                print(f"Failed to render math snippet {self.match.group(0)}: the rendered image was blank.")
+                return store.has(self.image_hash)
+            new_im.save(tmp_path)
+            os.replace(tmp_path, self.image_path)
+            store.add(self.image_hash)
+            return True
+        except Exception as e:
+            print(f"Failed to render math snippet {self.match.group(0)} with exception {e}")
+            return store.has(self.image_hash)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -2,6 +2,8 @@ import os
 import time
 
 from filesystem import FileSystem
+from imagestore import ImageStore
+from layoutmigration import LayoutMigration
 from mathfile import MathFile
 from regenhistory import RegenHistory
 from utils import get_files
@@ -23,23 +25,35 @@ class MathVault:
 
         self.fs = FileSystem(sm_collection_root, obsidian_vault_root)
 
-    def get_math_files(self, history: RegenHistory):
+    def get_math_files(self, history: RegenHistory, regen_all: bool = False):
         files = get_files(self.fs.obsidian_vault_root, ".md", True)
         return [
             MathFile(self.fs, file)
-            for file in files if history.should_regen(file)
+            for file in files if regen_all or history.should_regen(file)
         ]
 
-    def regenerate_cards(self):
+    def regenerate_cards(self, force_render: bool = False):
+        """
+        Regenerate cards for notes changed since the last run. With force_render, every note is
+        regenerated and its math images rendered again, e.g. to replace images that rendered badly.
+        """
+
+        # Regenerating a note that is still in the legacy layout would create fresh cloze folders
+        # that are not linked to the cards already imported into SM.
+        if not LayoutMigration(self.fs).migrate():
+            print("Not regenerating cards until the math folder has been migrated.")
+            return
 
         history = RegenHistory(self.fs)
-        files = self.get_math_files(history)
+        files = self.get_math_files(history, force_render)
         if files is None or len(files) == 0:
             print("No files to regenerate.")
             return
 
+        store = ImageStore(self.fs, force_render)
         for file in files:
-            file.regenerate_cards()
+            file.regenerate_cards(store)
+        store.close()
 
         history.data["global_last_regen"] = int(time.time())
         history.write()
@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the top level of the repo and import each other by name.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from filesystem import FileSystem  # noqa: E402
+
+
+@pytest.fixture
+def fs(tmp_path):
+    os.makedirs(tmp_path / "math")
+    return FileSystem(str(tmp_path), "/vault")
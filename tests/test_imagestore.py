@@ -0,0 +1,59 @@
+import os
+
+from filesystem import FileSystem
+from imagestore import ImageStore
+
+
+def add_image(fs: FileSystem, store: ImageStore, data: bytes):
+    image_hash = fs.get_content_hash(data)
+    path = fs.get_image_path(image_hash)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    store.add(image_hash)
+    return image_hash
+
+
+def test_unreferenced_images_are_removed(fs):
+    note_a = fs.get_note_folder("/vault/a.md")
+    note_b = fs.get_note_folder("/vault/b.md")
+    store = ImageStore(fs)
+    shared = add_image(fs, store, b"shared")
+    only_a = add_image(fs, store, b"only a")
+    store.update_note(note_a, [shared, only_a])
+    store.update_note(note_b, [shared])
+    store.close()
+
+    store = ImageStore(fs)
+    store.update_note(note_a, [])
+    store.close()
+
+    assert not os.path.exists(fs.get_image_path(only_a))
+    assert store.has(shared)
+    assert store.counts == {shared: 1}
+
+
+def test_interrupted_run_rebuilds_counts(fs):
+    note = fs.get_note_folder("/vault/a.md")
+    store = ImageStore(fs)
+    used = add_image(fs, store, b"used")
+    unused = add_image(fs, store, b"unused")
+    store.update_note(note, [used])
+    # No close(), as if the run had crashed.
+
+    store = ImageStore(fs)
+
+    assert store.counts == {used: 1}
+    assert not os.path.exists(fs.get_image_path(unused))
+
+
+def test_force_render_renders_each_image_once(fs):
+    store = ImageStore(fs)
+    image_hash = add_image(fs, store, b"image")
+    store.update_note(fs.get_note_folder("/vault/a.md"), [image_hash])
+    store.close()
+
+    store = ImageStore(fs, force_render=True)
+    assert not store.has(image_hash)
+    store.add(image_hash)
+    assert store.has(image_hash)
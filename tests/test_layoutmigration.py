@@ -0,0 +1,159 @@
+import json
+import os
+
+import pytest
+
+import utils
+
+from filesystem import FileSystem
+from imagestore import ImageStore
+from layoutmigration import LayoutMigration
+from const import LAYOUT_VERSION
+
+NOTE_PATH = "/vault/note.md"
+IMAGE_BYTES = b"rendered math"
+
+
+def build_legacy_note(fs: FileSystem, imported: bool):
+    """
+    Build math/<hash>/ as the flat layout left it: one image and one cloze, optionally imported into SM.
+    """
+    legacy_folder = os.path.join(fs.math_folder(), fs.get_path_hash(NOTE_PATH))
+    image_folder = fs.get_images_folder(legacy_folder)
+    os.makedirs(image_folder)
+    image = os.path.join(image_folder, "0123abcd.jpg")
+    with open(image, "wb") as f:
+        f.write(IMAGE_BYTES)
+
+    cloze_folder = os.path.join(legacy_folder, fs.get_path_hash(NOTE_PATH), "1")
+    os.makedirs(cloze_folder)
+    question_path = os.path.join(cloze_folder, "question.html")
+    answer_path = os.path.join(fs.sm_collection_root, "sm_component.htm") if imported \
+        else os.path.join(cloze_folder, "answer.html")
+    for path in [question_path, answer_path]:
+        with open(path, "w") as f:
+            f.write(f"<img src='file:///{image}'>")
+
+    with open(os.path.join(cloze_folder, "data.json"), "w") as f:
+        f.write(json.dumps({
+            "imported": imported,
+            "question_path": question_path,
+            "answer_path": answer_path,
+            "folder": cloze_folder,
+        }))
+
+    return legacy_folder, image
+
+
+def read_cloze(fs: FileSystem):
+    cloze_folder = os.path.join(fs.get_note_folder(NOTE_PATH), fs.get_path_hash(NOTE_PATH), "1")
+    with open(os.path.join(cloze_folder, "data.json")) as f:
+        return cloze_folder, json.loads(f.read())
+
+
+def read_text(path: str):
+    with open(path) as f:
+        return f.read()
+
+
+def assert_migrated(fs: FileSystem, legacy_folder: str, imported: bool):
+    store_image = fs.get_image_path(fs.get_content_hash(IMAGE_BYTES))
+    cloze_folder, meta = read_cloze(fs)
+
+    assert not os.path.exists(legacy_folder)
+    assert meta["imported"] == imported
+    assert meta["folder"] == cloze_folder
+    assert meta["question_path"] == os.path.join(cloze_folder, "question.html")
+    if imported:
+        assert meta["answer_path"] == os.path.join(fs.sm_collection_root, "sm_component.htm")
+    else:
+        assert meta["answer_path"] == os.path.join(cloze_folder, "answer.html")
+
+    with open(store_image, "rb") as f:
+        assert f.read() == IMAGE_BYTES
+    for path in [meta["question_path"], meta["answer_path"]]:
+        assert read_text(path) == f"<img src='file:///{store_image}'>"
+
+    note_folder = fs.get_note_folder(NOTE_PATH)
+    assert ImageStore.read_note_images(fs, note_folder) == [fs.get_content_hash(IMAGE_BYTES)]
+    assert not os.path.exists(fs.get_images_folder(note_folder))
+
+
+@pytest.mark.parametrize("imported", [False, True])
+def test_migrate_rewrites_metadata_and_images(fs, imported):
+    legacy_folder, _ = build_legacy_note(fs, imported)
+
+    assert LayoutMigration(fs).migrate()
+
+    assert_migrated(fs, legacy_folder, imported)
+    assert LayoutMigration(fs).data["version"] == LAYOUT_VERSION
+
+
+def test_interrupted_migration_resumes(fs, monkeypatch):
+    legacy_folder, legacy_image = build_legacy_note(fs, imported=True)
+
+    def interrupt(*args):
+        raise OSError("interrupted")
+
+    monkeypatch.setattr(LayoutMigration, "remove_legacy_images", interrupt)
+    assert not LayoutMigration(fs).migrate()
+
+    # Every path rewritten so far must point at an image that exists.
+    sm_component = os.path.join(fs.sm_collection_root, "sm_component.htm")
+    src = read_text(sm_component)[len("<img src='file:///"):-len("'>")]
+    assert os.path.exists(src)
+    assert os.path.exists(legacy_image)
+    assert "version" not in LayoutMigration(fs).data
+
+    monkeypatch.undo()
+    assert LayoutMigration(fs).migrate()
+
+    assert_migrated(fs, legacy_folder, imported=True)
+
+
+def test_merge_keeps_legacy_metadata(fs):
+    legacy_folder, _ = build_legacy_note(fs, imported=True)
+
+    # A note regenerated into the sharded layout before its legacy folder was migrated.
+    cloze_folder = os.path.join(fs.get_note_folder(NOTE_PATH), fs.get_path_hash(NOTE_PATH), "1")
+    os.makedirs(cloze_folder)
+    with open(os.path.join(cloze_folder, "data.json"), "w") as f:
+        f.write(json.dumps({"imported": False}))
+
+    assert LayoutMigration(fs).migrate()
+
+    assert_migrated(fs, legacy_folder, imported=True)
+
+
+@pytest.mark.parametrize("contents", ["", "{\"imported\": tr"])
+def test_unreadable_metadata_does_not_block_migration(fs, contents):
+    legacy_folder, _ = build_legacy_note(fs, imported=False)
+    cloze_folder = os.path.join(legacy_folder, fs.get_path_hash(NOTE_PATH), "1")
+    with open(os.path.join(cloze_folder, "data.json"), "w") as f:
+        f.write(contents)
+
+    assert LayoutMigration(fs).migrate()
+
+    cloze_folder = os.path.join(fs.get_note_folder(NOTE_PATH), fs.get_path_hash(NOTE_PATH), "1")
+    store_image = fs.get_image_path(fs.get_content_hash(IMAGE_BYTES))
+    assert not os.path.exists(legacy_folder)
+    assert read_text(os.path.join(cloze_folder, "data.json")) == contents
+    assert read_text(os.path.join(cloze_folder, "question.html")) == f"<img src='file:///{store_image}'>"
+    assert os.path.exists(store_image)
+
+
+def test_interrupted_rewrite_keeps_sm_component(fs, monkeypatch):
+    _, legacy_image = build_legacy_note(fs, imported=True)
+    sm_component = os.path.join(fs.sm_collection_root, "sm_component.htm")
+    replace = os.replace
+
+    def interrupt(src, dst):
+        if dst == sm_component:
+            raise OSError("interrupted")
+        replace(src, dst)
+
+    monkeypatch.setattr(utils.os, "replace", interrupt)
+    assert not LayoutMigration(fs).migrate()
+
+    assert read_text(sm_component) == f"<img src='file:///{legacy_image}'>"
+    assert sorted(os.listdir(fs.sm_collection_root)) == ["math", "sm_component.htm"]
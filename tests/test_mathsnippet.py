@@ -0,0 +1,111 @@
+import os
+import re
+
+import pytest
+
+imgkit = pytest.importorskip("imgkit")
+Image = pytest.importorskip("PIL.Image")
+
+from const import MATHJAX_REGEX, TMP_FILE_PREFIX  # noqa: E402
+from filesystem import FileSystem  # noqa: E402
+from imagestore import ImageStore  # noqa: E402
+from mathsnippet import MathSnippet  # noqa: E402
+
+NOTE_PATH = "/vault/note.md"
+
+
+class FakeRenderer:
+    """
+    Stands in for imgkit.from_string, drawing a black box for math or a blank page, or failing outright.
+    """
+
+    def __init__(self, result: str = "math"):
+        self.result = result
+        self.calls = 0
+
+    def __call__(self, html, path, options=None):
+        self.calls += 1
+        if self.result == "error":
+            raise OSError("wkhtmltoimage failed")
+
+        im = Image.new("RGB", (100, 40), "white")
+        if self.result == "math":
+            im.paste((0, 0, 0), (20, 10, 60, 30))
+        im.save(path)
+
+
+@pytest.fixture
+def renderer(monkeypatch):
+    renderer = FakeRenderer()
+    monkeypatch.setattr(imgkit, "from_string", renderer)
+    return renderer
+
+
+def snippet(fs: FileSystem, source: str = "$x^2$"):
+    return MathSnippet(fs, re.search(MATHJAX_REGEX, source))
+
+
+def store_files(fs: FileSystem):
+    return [file for _, _, files in os.walk(fs.image_store_folder()) for file in files]
+
+
+def render_previous(fs: FileSystem):
+    """
+    Render the snippet in a normal run and reference it from a note, so later runs have an image to fall back on.
+    """
+    store = ImageStore(fs)
+    s = snippet(fs)
+    assert s.generate_image(store)
+    store.update_note(fs.get_note_folder(NOTE_PATH), [s.image_hash])
+    store.close()
+    with open(s.image_path, "rb") as f:
+        return f.read()
+
+
+def test_shared_snippet_is_rendered_once(fs, renderer):
+    store = ImageStore(fs)
+
+    assert snippet(fs).generate_image(store)
+    assert snippet(fs).generate_image(store)
+
+    assert renderer.calls == 1
+    assert store_files(fs) == [os.path.basename(snippet(fs).image_path)]
+
+
+def test_forced_render_renders_once_per_run(fs, renderer):
+    render_previous(fs)
+    renderer.calls = 0
+
+    store = ImageStore(fs, force_render=True)
+    assert snippet(fs).generate_image(store)
+    assert snippet(fs).generate_image(store)
+
+    assert renderer.calls == 1
+
+
+@pytest.mark.parametrize("result", ["blank", "error"])
+def test_failed_forced_render_keeps_previous_image(fs, renderer, result):
+    previous = render_previous(fs)
+    renderer.calls = 0
+    renderer.result = result
+
+    store = ImageStore(fs, force_render=True)
+    assert snippet(fs).generate_image(store)
+    assert snippet(fs).generate_image(store)
+
+    assert renderer.calls == 1
+    with open(snippet(fs).image_path, "rb") as f:
+        assert f.read() == previous
+    assert not any(file.startswith(TMP_FILE_PREFIX) for file in store_files(fs))
+
+
+@pytest.mark.parametrize("result", ["blank", "error"])
+def test_failed_render_leaves_nothing_in_store(fs, renderer, result):
+    renderer.result = result
+    store = ImageStore(fs)
+
+    assert not snippet(fs).generate_image(store)
+    assert not snippet(fs).generate_image(store)
+
+    assert renderer.calls == 1
+    assert store_files(fs) == []
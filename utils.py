@@ -1,6 +1,11 @@
+import os
+import shutil
 import typing as T
+import uuid
 from pathlib import Path
 
+from const import TMP_FILE_PREFIX
+
 
 def get_files(path: str, ext: str, recurse: bool = False) -> T.Iterable[Path]:
     """
@@ -20,3 +25,21 @@ def get_files(path: str, ext: str, recurse: bool = False) -> T.Iterable[Path]:
         yield path
     else:
         raise FileNotFoundError(path)
+
+
+def write_atomic(path: str, data: str):
+    """
+    Write data to path through a temporary file in the same folder, so a crash never leaves path half written.
+    """
+
+    folder, name = os.path.split(path)
+    tmp_path = os.path.join(folder, TMP_FILE_PREFIX + uuid.uuid4().hex + os.path.splitext(name)[1])
+    try:
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        if os.path.exists(path):
+            shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)